@@ -1,7 +1,10 @@
 from flask import Flask, render_template, request, jsonify
 from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+import threading
 import model_utils
 import train_model
+import stopwords
 import os
 import json
 
@@ -12,12 +15,115 @@ import gcs_handler
 
 # Cache for loaded models: { "media_name": (model, dictionary) }
 loaded_models = {}
+# Model dir each cache entry was loaded from: { "media_name": dir }
+loaded_model_markers = {}
+# One lock per media, so loading one media never blocks requests for another
+_media_locks = {}
+_media_locks_guard = threading.Lock()
+
+def _media_lock(media_name):
+    with _media_locks_guard:
+        return _media_locks.setdefault(media_name, threading.Lock())
+
+def _is_fresh(media_name):
+    # A retrain (in any worker) swaps models/<media>/current to a new version dir
+    return media_name in loaded_models and loaded_model_markers.get(media_name) == model_utils.get_current_model_dir(media_name)
 
 def get_or_load_model(media_name):
-    if media_name not in loaded_models:
-        print(f"Loading model for {media_name}...")
-        loaded_models[media_name] = model_utils.load_model(media_name)
-    return loaded_models[media_name]
+    if _is_fresh(media_name):
+        return loaded_models[media_name]
+
+    lock = _media_lock(media_name)
+    cached = loaded_models.get(media_name)
+    if cached is not None:
+        # While another thread reloads, keep serving the model we already have
+        if not lock.acquire(blocking=False):
+            return cached
+    else:
+        lock.acquire()
+
+    try:
+        if not _is_fresh(media_name):
+            print(f"Loading model for {media_name}...")
+            # Read the marker before loading: if a swap lands mid-load we
+            # reload once more rather than keep a stale model forever
+            marker = model_utils.get_current_model_dir(media_name)
+            model_tuple = model_utils.load_model(media_name)
+            loaded_model_markers[media_name] = marker
+            loaded_models[media_name] = model_tuple
+        return loaded_models[media_name]
+    finally:
+        lock.release()
+
+def clear_model_cache(media_name):
+    with _media_lock(media_name):
+        loaded_models.pop(media_name, None)
+        loaded_model_markers.pop(media_name, None)
+
+# Default scoring for /predict: "exact" (variational inference) or "fast"
+# (precomputed word-topic table). Requests can override it with "mode".
+PREDICT_MODE = os.environ.get("PREDICT_MODE", "exact")
+
+# GCS-bound endpoints (/model_status, /stopwords, /seed_stopwords) run their
+# bucket calls on this small pool and wait at most GCS_IO_TIMEOUT for them
+# (then 504). A request that finds every slot taken gets a 503 right away, so
+# at most GCS_MAX_INFLIGHT request threads per worker ever wait on the bucket.
+# That is capped below the thread count, leaving threads free for /predict.
+_threads = int(os.environ.get("GUNICORN_THREADS", 2))
+GCS_MAX_INFLIGHT = int(os.environ.get("GCS_MAX_INFLIGHT", _threads // 2))
+GCS_MAX_INFLIGHT = max(1, min(GCS_MAX_INFLIGHT, _threads - 1))
+GCS_IO_TIMEOUT = float(os.environ.get("GCS_IO_TIMEOUT", 30))
+gcs_executor = ThreadPoolExecutor(max_workers=GCS_MAX_INFLIGHT, thread_name_prefix="gcs-io")
+gcs_slots = threading.BoundedSemaphore(GCS_MAX_INFLIGHT)
+
+class GCSUnavailable(Exception):
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+    @property
+    def headers(self):
+        # Clients (static/main.js) retry a busy 503 after this many seconds
+        return {"Retry-After": "1"} if self.status == 503 else {}
+
+def run_gcs(func, *args):
+    """
+    Runs a blocking GCS call on gcs_executor and returns its result.
+    Raises GCSUnavailable (503) at once if all slots are taken, or (504)
+    after GCS_IO_TIMEOUT. A timed-out call keeps its slot until it actually
+    returns, so stuck calls cannot pile up.
+    """
+    if not gcs_slots.acquire(blocking=False):
+        raise GCSUnavailable("Storage is busy, please retry shortly.", 503)
+    try:
+        future = gcs_executor.submit(func, *args)
+    except Exception:
+        gcs_slots.release()
+        raise
+    future.add_done_callback(lambda _: gcs_slots.release())
+
+    try:
+        return future.result(timeout=GCS_IO_TIMEOUT)
+    except FuturesTimeoutError:
+        raise GCSUnavailable(f"Storage call timed out after {GCS_IO_TIMEOUT:.0f}s.", 504)
+
+def preload_models(media_list=None):
+    """
+    Load models, stopwords and the jieba dictionary before serving.
+    Called in the gunicorn master (see gunicorn.conf.py) so that forked
+    workers share these pages copy-on-write instead of loading their own.
+    """
+    if media_list is None:
+        media_list = [m.strip() for m in os.environ.get("PRELOAD_MEDIA", "edh").split(",") if m.strip()]
+
+    import jieba
+    jieba.initialize()
+
+    for media in media_list:
+        model_tuple = get_or_load_model(media)
+        if model_tuple[0] is None:
+            print(f"Preload: no model available for {media}, it will be loaded on first request.")
+        stopwords.get_cached_stopwords(media)
 
 @app.route('/')
 def index():
@@ -34,12 +140,51 @@ def trigger_train():
     
     if result.get("success"):
         # Clear cache so next prediction reloads the new model
-        if media in loaded_models:
-            del loaded_models[media]
+        clear_model_cache(media)
         return jsonify(result)
     else:
         return jsonify(result), 500
 
+def _merge_stopwords(media, new_words):
+    """
+    Merges new_words into the custom stopwords in GCS.
+    Blocking; runs on the GCS I/O pool. Returns (payload, status).
+    """
+    data_dir = os.path.join("data", media)
+    os.makedirs(data_dir, exist_ok=True)
+    custom_path = os.path.join(data_dir, "custom_stopwords.json")
+    gcs_path = f"stopwords/{media}/custom_stopwords.json"
+    
+    # Sync: Try to get latest from GCS first to ensure we merge with existing cloud state
+    gcs_handler.download_file(gcs_path, custom_path)
+    
+    current_words = []
+    if os.path.exists(custom_path):
+        with open(custom_path, "r", encoding="utf-8") as f:
+            content = f.read()
+            if content:
+                current_words = json.loads(content)
+    
+    # Merge and dedup
+    updated_set = set(current_words).union(set(new_words))
+    updated_list = list(updated_set)
+    
+    # Write-then-rename so other workers never read a half-written file
+    tmp_path = f"{custom_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(updated_list, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, custom_path)
+    stopwords.clear_cached_stopwords(media)
+        
+    # Sync: Upload back to GCS
+    print(f"Uploading updated stopwords to {gcs_path}")
+    success = gcs_handler.upload_file(custom_path, gcs_path)
+    
+    if not success:
+        return {"success": False, "message": "Failed to persist stopwords to GCS."}, 500
+        
+    return {"success": True, "message": f"Added {len(new_words)} words to stopwords and synced to GCS."}, 200
+
 @app.route('/stopwords', methods=['POST'])
 def add_stopwords():
     data = request.get_json()
@@ -50,36 +195,10 @@ def add_stopwords():
         return jsonify({"success": True, "message": "No words to add."})
 
     try:
-        data_dir = os.path.join("data", media)
-        os.makedirs(data_dir, exist_ok=True)
-        custom_path = os.path.join(data_dir, "custom_stopwords.json")
-        gcs_path = f"stopwords/{media}/custom_stopwords.json"
-        
-        # Sync: Try to get latest from GCS first to ensure we merge with existing cloud state
-        gcs_handler.download_file(gcs_path, custom_path)
-        
-        current_words = []
-        if os.path.exists(custom_path):
-            with open(custom_path, "r", encoding="utf-8") as f:
-                content = f.read()
-                if content:
-                    current_words = json.loads(content)
-        
-        # Merge and dedup
-        updated_set = set(current_words).union(set(new_words))
-        updated_list = list(updated_set)
-        
-        with open(custom_path, "w", encoding="utf-8") as f:
-            json.dump(updated_list, f, ensure_ascii=False, indent=2)
-            
-        # Sync: Upload back to GCS
-        print(f"Uploading updated stopwords to {gcs_path}")
-        success = gcs_handler.upload_file(custom_path, gcs_path)
-        
-        if not success:
-            return jsonify({"success": False, "message": "Failed to persist stopwords to GCS."}), 500
-            
-        return jsonify({"success": True, "message": f"Added {len(new_words)} words to stopwords and synced to GCS."})
+        payload, status = run_gcs(_merge_stopwords, media, new_words)
+        return jsonify(payload), status
+    except GCSUnavailable as e:
+        return jsonify({"success": False, "message": str(e)}), e.status, e.headers
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
@@ -88,24 +207,26 @@ def predict():
     data = request.get_json()
     text = data.get('text', '')
     media = data.get('media', 'edh') # Default to edh
+    mode = data.get('mode', PREDICT_MODE)
     
     if not text:
         return jsonify({'error': 'No text provided'}), 400
+    if mode not in ('exact', 'fast'):
+        return jsonify({'error': f"Unknown mode '{mode}'. Use 'exact' or 'fast'."}), 400
     
     model_tuple = get_or_load_model(media)
     if model_tuple[0] is None:
          return jsonify({'error': f'Model for {media} not found. Please train it first.'}), 404
          
-    topics = model_utils.get_topics(model_tuple, text, media)
-    return jsonify({'topics': topics, 'media': media})
-
-    topics = model_utils.get_topics(model_tuple, text, media)
-    return jsonify({'topics': topics, 'media': media})
+    topics = model_utils.get_topics(model_tuple, text, media, exact=(mode == 'exact'))
+    return jsonify({'topics': topics, 'media': media, 'mode': mode})
 
 @app.route('/model_status/<media>', methods=['GET'])
 def model_status(media):
     try:
-        versions = gcs_handler.list_model_versions(media)
+        versions = gcs_handler.get_cached_versions(media)
+        if versions is None:
+            versions = run_gcs(gcs_handler.list_model_versions_cached, media)
         if versions:
             # Return true and the latest version
             return jsonify({
@@ -115,6 +236,8 @@ def model_status(media):
             })
         else:
             return jsonify({"exists": False})
+    except GCSUnavailable as e:
+        return jsonify({"exists": False, "error": str(e)}), e.status, e.headers
     except Exception as e:
         print(f"Error checking status for {media}: {e}")
         return jsonify({"exists": False, "error": str(e)}), 500
@@ -135,12 +258,14 @@ def seed_stopwords():
         if not os.path.exists(local_path):
              return jsonify({"success": False, "message": f"Local file not found: {local_path}"}), 404
              
-        success = gcs_handler.upload_file(local_path, gcs_path)
+        success = run_gcs(gcs_handler.upload_file, local_path, gcs_path)
         if success:
             return jsonify({"success": True, "message": f"Seeded {gcs_path}"})
         else:
             return jsonify({"success": False, "message": "Upload failed."}), 500
             
+    except GCSUnavailable as e:
+         return jsonify({"success": False, "message": str(e)}), e.status, e.headers
     except Exception as e:
          return jsonify({"success": False, "message": str(e)}), 500
 
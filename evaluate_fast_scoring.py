@@ -0,0 +1,116 @@
+"""
+Accuracy-vs-latency report for fast scoring (precomputed word-topic table)
+against exact variational inference, on a holdout sample of documents.
+
+By default it scores data/<media>/holdout.json, the split train_model.py
+sets aside and never trains on. Any other --data file must likewise hold
+documents the model was not trained on.
+
+    python evaluate_fast_scoring.py --media edh --samples 500
+"""
+import argparse
+import json
+import os
+import random
+import time
+import numpy as np
+from dotenv import load_dotenv
+import model_utils
+
+load_dotenv()
+
+def dense(dist, num_topics):
+    vec = np.zeros(num_topics)
+    for tid, p in dist:
+        vec[tid] = p
+    return vec
+
+def percentile_ms(values, q):
+    return float(np.percentile(values, q) * 1000) if values else 0.0
+
+def load_holdout(path, media, samples, seed):
+    """
+    Returns up to `samples` cleaned token lists drawn from a training-format
+    JSON file ([{"word": [...]}, ...]).
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        raw_docs = json.load(f)
+
+    docs = []
+    for doc in raw_docs:
+        words = doc.get("word", [])
+        if isinstance(words, list):
+            tokens = model_utils.clean_tokens(words, media)
+            if tokens:
+                docs.append(tokens)
+
+    random.Random(seed).shuffle(docs)
+    return docs[:samples]
+
+def evaluate(media, data_path, samples=500, seed=0, topn=5):
+    if not os.path.exists(data_path):
+        raise SystemExit(f"Holdout data not found at {data_path}. Run train_model.py --media {media} --force to create it.")
+
+    model, dictionary = model_utils.load_model(media)
+    if model is None or dictionary is None:
+        raise SystemExit(f"Model for {media} could not be loaded.")
+
+    docs = load_holdout(data_path, media, samples, seed)
+
+    num_topics = model.num_topics
+    exact_times, fast_times = [], []
+    top1_hits, topn_overlaps, hellinger = [], [], []
+
+    for tokens in docs:
+        bow = dictionary.doc2bow(tokens)
+        if not bow:
+            continue
+
+        start = time.perf_counter()
+        exact = model_utils.infer_topics(model, bow, exact=True, minimum_probability=0.0)
+        exact_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        fast = model_utils.infer_topics(model, bow, exact=False, minimum_probability=0.0)
+        fast_times.append(time.perf_counter() - start)
+
+        p, q = dense(exact, num_topics), dense(fast, num_topics)
+        exact_top = np.argsort(-p)[:topn]
+        fast_top = np.argsort(-q)[:topn]
+        top1_hits.append(exact_top[0] == fast_top[0])
+        topn_overlaps.append(len(set(exact_top) & set(fast_top)) / len(exact_top))
+        hellinger.append(float(np.sqrt(0.5 * np.sum((np.sqrt(p) - np.sqrt(q)) ** 2))))
+
+    if not exact_times:
+        raise SystemExit(f"No holdout documents with known words in {data_path}.")
+
+    return {
+        "media": media,
+        "holdout_data": os.path.abspath(data_path),
+        "documents": len(exact_times),
+        "accuracy": {
+            "top1_agreement": float(np.mean(top1_hits)),
+            f"top{topn}_overlap": float(np.mean(topn_overlaps)),
+            "mean_hellinger": float(np.mean(hellinger)),
+        },
+        "latency_ms": {
+            "exact": {"p50": percentile_ms(exact_times, 50), "p95": percentile_ms(exact_times, 95), "mean": float(np.mean(exact_times) * 1000)},
+            "fast": {"p50": percentile_ms(fast_times, 50), "p95": percentile_ms(fast_times, 95), "mean": float(np.mean(fast_times) * 1000)},
+        },
+        "speedup": float(np.mean(exact_times) / np.mean(fast_times)),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare fast (table) scoring against exact LDA inference.")
+    parser.add_argument("--media", type=str, default="edh", help="Media name (folder name in data/)")
+    parser.add_argument("--data", type=str, default=None, help="Holdout JSON ([{\"word\": [...]}, ...]) with documents not used for training (default: data/<media>/holdout.json)")
+    parser.add_argument("--samples", type=int, default=500, help="Number of documents to score")
+    parser.add_argument("--seed", type=int, default=0, help="Sampling seed")
+    args = parser.parse_args()
+
+    data_path = args.data or os.path.join("data", args.media, "holdout.json")
+    report = evaluate(args.media, data_path, samples=args.samples, seed=args.seed)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
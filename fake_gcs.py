@@ -0,0 +1,273 @@
+"""
+Minimal in-memory stand-in for the GCS JSON API, for local load tests.
+
+Covers what gcs_handler uses through google-cloud-storage: listing (with
+prefix/delimiter), object metadata, media download, multipart and resumable
+upload, and delete. Point the client at it with STORAGE_EMULATOR_HOST.
+
+    server = FakeGCSServer()
+    server.start()
+    os.environ["STORAGE_EMULATOR_HOST"] = server.url
+
+Or as its own process (prints the URL on the first line of stdout), so it
+does not share a GIL with whatever is driving the load:
+
+    python fake_gcs.py --port 0
+"""
+import argparse
+import base64
+import hashlib
+import json
+import struct
+import threading
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+try:
+    import google_crc32c
+except ImportError:
+    google_crc32c = None
+
+def _crc32c(data):
+    if google_crc32c is not None:
+        return google_crc32c.value(data)
+    # Bitwise CRC-32C (Castagnoli); only hit without google-crc32c installed
+    crc = 0xFFFFFFFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ (0x82F63B78 & -(crc & 1))
+    return crc ^ 0xFFFFFFFF
+
+def _metadata(bucket, name, data, updated=None):
+    return {
+        "kind": "storage#object",
+        "id": f"{bucket}/{name}/1",
+        "bucket": bucket,
+        "name": name,
+        "generation": "1",
+        "metageneration": "1",
+        "size": str(len(data)),
+        "contentType": "application/octet-stream",
+        "md5Hash": base64.b64encode(hashlib.md5(data).digest()).decode("ascii"),
+        "crc32c": base64.b64encode(struct.pack(">I", _crc32c(data))).decode("ascii"),
+        "updated": updated or datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+    }
+
+class FakeGCSServer:
+    def __init__(self, host="127.0.0.1", port=0):
+        # { bucket: { object_name: bytes } }
+        self.buckets = {}
+        # { (bucket, object_name): RFC 3339 time of the last write }
+        self.updated = {}
+        # { upload_id: {"bucket", "name", "data": bytearray} }
+        self.uploads = {}
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def put(self, bucket, name, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with self.lock:
+            self.buckets.setdefault(bucket, {})[name] = bytes(data)
+            self.updated[(bucket, name)] = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+    def get(self, bucket, name):
+        with self.lock:
+            return self.buckets.get(bucket, {}).get(name)
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body=b"", headers=None, content_type="application/json"):
+                if isinstance(body, (dict, list)):
+                    body = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _not_found(self):
+                self._send(404, {"error": {"code": 404, "message": "Not Found"}})
+
+            def _body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                return self.rfile.read(length) if length else b""
+
+            def _route(self):
+                """
+                Returns (bucket, object_name or None, query) for a JSON API path.
+                """
+                parts = urlsplit(self.path)
+                query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+                path = parts.path
+                for base in ("/download/storage/v1/b/", "/upload/storage/v1/b/", "/storage/v1/b/"):
+                    if path.startswith(base):
+                        rest = path[len(base):]
+                        break
+                else:
+                    return None, None, query
+                bucket, _, obj = rest.partition("/")
+                name = unquote(obj[2:]) if obj.startswith("o/") else None
+                return unquote(bucket), name, query
+
+            def do_GET(self):
+                bucket, name, query = self._route()
+                if bucket is None:
+                    return self._not_found()
+
+                if name is None:
+                    return self._list(bucket, query)
+
+                data = server.get(bucket, name)
+                if data is None:
+                    return self._not_found()
+                meta = _metadata(bucket, name, data, server.updated.get((bucket, name)))
+                if query.get("alt") == "media":
+                    return self._send(200, data, {
+                        "x-goog-generation": "1",
+                        "x-goog-hash": f"crc32c={meta['crc32c']},md5={meta['md5Hash']}",
+                    }, content_type="application/octet-stream")
+                self._send(200, meta)
+
+            def _list(self, bucket, query):
+                prefix = query.get("prefix", "")
+                delimiter = query.get("delimiter")
+                with server.lock:
+                    objects = dict(server.buckets.get(bucket, {}))
+
+                items, prefixes = [], set()
+                for name in sorted(objects):
+                    if not name.startswith(prefix):
+                        continue
+                    rest = name[len(prefix):]
+                    if delimiter and delimiter in rest:
+                        prefixes.add(prefix + rest[:rest.index(delimiter) + len(delimiter)])
+                    else:
+                        items.append(_metadata(bucket, name, objects[name], server.updated.get((bucket, name))))
+                self._send(200, {"kind": "storage#objects", "items": items, "prefixes": sorted(prefixes)})
+
+            def do_DELETE(self):
+                bucket, name, _ = self._route()
+                with server.lock:
+                    objects = server.buckets.get(bucket, {})
+                    if name not in objects:
+                        return self._not_found()
+                    del objects[name]
+                    server.updated.pop((bucket, name), None)
+                self._send(204)
+
+            def do_POST(self):
+                bucket, _, query = self._route()
+                if bucket is None:
+                    return self._not_found()
+                body = self._body()
+                upload_type = query.get("uploadType")
+
+                if upload_type == "multipart":
+                    meta, data = self._parse_multipart(body)
+                    name = meta.get("name") or query.get("name")
+                    server.put(bucket, name, data)
+                    return self._send(200, _metadata(bucket, name, data))
+
+                if upload_type == "resumable":
+                    meta = json.loads(body) if body else {}
+                    upload_id = uuid.uuid4().hex
+                    with server.lock:
+                        server.uploads[upload_id] = {
+                            "bucket": bucket,
+                            "name": meta.get("name") or query.get("name"),
+                            "data": bytearray(),
+                        }
+                    location = f"{server.url}/upload/storage/v1/b/{quote(bucket)}/o?uploadType=resumable&upload_id={upload_id}"
+                    return self._send(200, b"", {"Location": location})
+
+                if upload_type == "media":
+                    name = query.get("name")
+                    server.put(bucket, name, body)
+                    return self._send(200, _metadata(bucket, name, body))
+
+                self._send(400, {"error": {"code": 400, "message": f"Unsupported uploadType {upload_type}"}})
+
+            def do_PUT(self):
+                _, _, query = self._route()
+                upload = server.uploads.get(query.get("upload_id"))
+                if upload is None:
+                    return self._not_found()
+                chunk = self._body()
+                upload["data"].extend(chunk)
+
+                # Content-Range: "bytes 0-99/200", "bytes 0-99/*" or "bytes */200"
+                content_range = self.headers.get("Content-Range", "")
+                total = content_range.rsplit("/", 1)[-1] if "/" in content_range else "*"
+                received = len(upload["data"])
+                if total != "*" and received >= int(total):
+                    with server.lock:
+                        server.uploads.pop(query.get("upload_id"), None)
+                    server.put(upload["bucket"], upload["name"], upload["data"])
+                    return self._send(200, _metadata(upload["bucket"], upload["name"], bytes(upload["data"])))
+
+                headers = {"Range": f"bytes=0-{received - 1}"} if received else {}
+                self._send(308, b"", headers)
+
+            def _parse_multipart(self, body):
+                content_type = self.headers.get("Content-Type", "")
+                boundary = content_type.split("boundary=", 1)[-1].strip('"').encode("ascii")
+                parts = body.split(b"--" + boundary)
+                # parts: [preamble, metadata part, media part, "--\r\n"]
+                payloads = []
+                for part in parts[1:]:
+                    if part.startswith(b"--"):
+                        break
+                    _, _, content = part.partition(b"\r\n\r\n")
+                    payloads.append(content[:-2] if content.endswith(b"\r\n") else content)
+                meta = json.loads(payloads[0]) if payloads else {}
+                data = payloads[1] if len(payloads) > 1 else b""
+                return meta, data
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve an in-memory fake of the GCS JSON API.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Interface to bind")
+    parser.add_argument("--port", type=int, default=0, help="Port to bind (0 picks a free one)")
+    args = parser.parse_args()
+
+    server = FakeGCSServer(args.host, args.port)
+    print(server.url, flush=True)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+if __name__ == "__main__":
+    main()
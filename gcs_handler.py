@@ -1,9 +1,31 @@
 import os
+import threading
+import time
 from google.cloud import storage
 
+# Seconds a cached version listing stays valid (see list_model_versions_cached)
+VERSION_CACHE_TTL = float(os.environ.get("GCS_VERSION_CACHE_TTL", 30))
+
+# { "media": (fetched_at, versions) }
+_version_cache = {}
+_version_cache_lock = threading.Lock()
+
+_local = threading.local()
+
 def get_bucket_name():
     return os.environ.get("GCS_BUCKET_NAME")
 
+def get_client():
+    """
+    Returns a storage client reused by the calling thread.
+    Clients hold an HTTP session, so they are not shared across threads, and
+    are recreated after a fork (gunicorn preloads in the master).
+    """
+    if getattr(_local, "pid", None) != os.getpid():
+        _local.client = storage.Client()
+        _local.pid = os.getpid()
+    return _local.client
+
 def get_keys_blobs(bucket, prefix):
     """
     Helper to list all blobs with a prefix
@@ -14,14 +36,15 @@ def upload_folder(local_folder, gcs_path):
     """
     Uploads a local folder to a GCS path.
     Example: local_folder='models/edh', gcs_path='models/edh/20230101'
+    Returns True if every file was uploaded.
     """
     bucket_name = get_bucket_name()
     if not bucket_name:
         print("GCS_BUCKET_NAME not set. Skipping upload.")
-        return
+        return False
 
     try:
-        storage_client = storage.Client()
+        storage_client = get_client()
         bucket = storage_client.bucket(bucket_name)
 
         print(f"Uploading {local_folder} to gs://{bucket_name}/{gcs_path} ...")
@@ -40,57 +63,136 @@ def upload_folder(local_folder, gcs_path):
                 blob = bucket.blob(blob_path)
                 blob.upload_from_filename(local_file_path)
         
+        invalidate_version_cache()
         print(f"Successfully uploaded.")
+        return True
     except Exception as e:
         print(f"Failed to upload to GCS: {e}")
+        return False
+
+def list_model_versions_cached(media, ttl=None):
+    """
+    Same as list_model_versions, but reuses a listing younger than ttl seconds
+    (default VERSION_CACHE_TTL). Meant for status polling; training and model
+    loading use the uncached listing. Raises on bucket errors, which are
+    never cached.
+    """
+    versions = get_cached_versions(media, ttl)
+    if versions is not None:
+        return versions
+
+    versions = _list_model_versions(media)
+    with _version_cache_lock:
+        _version_cache[media] = (time.monotonic(), versions)
+    return list(versions)
+
+def get_cached_versions(media, ttl=None):
+    """
+    Returns the cached version listing for media, or None if missing or stale.
+    Never touches GCS.
+    """
+    ttl = VERSION_CACHE_TTL if ttl is None else ttl
+    entry = _version_cache.get(media)
+    if entry is None or time.monotonic() - entry[0] >= ttl:
+        return None
+    return list(entry[1])
+
+def invalidate_version_cache(media=None):
+    """
+    Drops cached version listings for media (or all media if None).
+    """
+    with _version_cache_lock:
+        if media is None:
+            _version_cache.clear()
+        else:
+            _version_cache.pop(media, None)
 
 def list_model_versions(media):
     """
     Returns a sorted list of version strings (timestamps) found in GCS for a media.
     Assumes structure: models/{media}/{timestamp}/...
+    Returns [] if the bucket cannot be listed.
+    """
+    try:
+        return _list_model_versions(media)
+    except Exception as e:
+        print(f"Error listing versions: {e}")
+        return []
+
+def _list_model_versions(media):
+    """
+    Like list_model_versions, but raises on bucket errors instead of
+    returning [] (so callers can tell "no versions" from "listing failed").
+    """
+    bucket_name = get_bucket_name()
+    if not bucket_name:
+        return []
+
+    return sorted(list_subfolders(f"models/{media}/"))
+
+def list_subfolders(prefix):
+    """
+    Returns the names of the "folders" directly under prefix (ending in '/').
+    Raises on bucket errors.
     """
     bucket_name = get_bucket_name()
     if not bucket_name:
         return []
 
+    storage_client = get_client()
+    bucket = storage_client.bucket(bucket_name)
+    
+    # We need to simulate directory listing.
+    # delimiter='/' makes it return 'prefixes' (subdirectories)
+    blobs = bucket.list_blobs(prefix=prefix, delimiter='/')
+    
+    # Force iteration to populate prefixes
+    list(blobs)
+    
+    folders = []
+    for p in blobs.prefixes:
+        # p is like 'models/edh/20231222_120000/'
+        # extract the last part
+        parts = p.rstrip('/').split('/')
+        if parts:
+            folders.append(parts[-1])
+    return folders
+
+def get_updated_time(gcs_path):
+    """
+    Returns when gcs_path was last written (timezone-aware datetime), or None
+    if it does not exist or cannot be read.
+    """
+    bucket_name = get_bucket_name()
+    if not bucket_name:
+        return None
+
     try:
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
-        prefix = f"models/{media}/"
-        
-        # We need to simulate directory listing.
-        # delimiter='/' makes it return 'prefixes' (subdirectories)
-        blobs = bucket.list_blobs(prefix=prefix, delimiter='/')
-        
-        # Force iteration to populate prefixes
-        list(blobs)
-        
-        versions = []
-        for p in blobs.prefixes:
-            # p is like 'models/edh/20231222_120000/'
-            # extract the last part
-            parts = p.rstrip('/').split('/')
-            if parts:
-                versions.append(parts[-1])
-                
-        versions.sort()
-        return versions
+        storage_client = get_client()
+        blob = storage_client.bucket(bucket_name).get_blob(gcs_path)
+        return blob.updated if blob is not None else None
     except Exception as e:
-        print(f"Error listing versions: {e}")
-        return []
+        print(f"Failed to read metadata of {gcs_path}: {e}")
+        return None
 
 def download_specific_version(media, version, local_destination):
     """
     Downloads models/{media}/{version}/* to local_destination
     """
+    return download_folder(f"models/{media}/{version}/", local_destination)
+
+def download_folder(gcs_prefix, local_destination):
+    """
+    Downloads every blob under gcs_prefix (ending in '/') to local_destination,
+    keeping paths relative to the prefix. Returns True if anything was downloaded.
+    """
     bucket_name = get_bucket_name()
     if not bucket_name:
         return False
         
     try:
-        storage_client = storage.Client()
+        storage_client = get_client()
         bucket = storage_client.bucket(bucket_name)
-        gcs_prefix = f"models/{media}/{version}/"
         
         blobs = bucket.list_blobs(prefix=gcs_prefix)
         
@@ -98,7 +200,7 @@ def download_specific_version(media, version, local_destination):
         for blob in blobs:
             if blob.name.endswith("/"): continue
             
-            # relpath inside the version folder
+            # relpath inside the folder
             # blob.name = models/edh/2023.../lda.model
             # rel = lda.model
             relative_path = blob.name[len(gcs_prefix):] 
@@ -118,23 +220,31 @@ def delete_version(media, version):
     """
     Deletes models/{media}/{version}/ recursively
     """
+    if delete_folder(f"models/{media}/{version}/"):
+        invalidate_version_cache(media)
+        print(f"Deleted old version: {version}")
+
+def delete_folder(gcs_prefix):
+    """
+    Deletes every blob under gcs_prefix. Returns True if anything was deleted.
+    """
     bucket_name = get_bucket_name()
     if not bucket_name:
-        return
+        return False
 
     try:
-        storage_client = storage.Client()
+        storage_client = get_client()
         bucket = storage_client.bucket(bucket_name)
-        prefix = f"models/{media}/{version}/"
         
-        blobs = list(bucket.list_blobs(prefix=prefix))
+        blobs = list(bucket.list_blobs(prefix=gcs_prefix))
         if not blobs:
-            return
+            return False
             
         bucket.delete_blobs(blobs)
-        print(f"Deleted old version: {version}")
+        return True
     except Exception as e:
-        print(f"Failed to delete version {version}: {e}")
+        print(f"Failed to delete {gcs_prefix}: {e}")
+        return False
 
 def upload_file(local_path, gcs_path):
     """
@@ -145,7 +255,7 @@ def upload_file(local_path, gcs_path):
         return
     
     try:
-        storage_client = storage.Client()
+        storage_client = get_client()
         bucket = storage_client.bucket(bucket_name)
         blob = bucket.blob(gcs_path)
         blob.upload_from_filename(local_path)
@@ -158,22 +268,40 @@ def upload_file(local_path, gcs_path):
 def download_file(gcs_path, local_destination):
     """
     Downloads a single file from GCS to local_destination.
+    The file is replaced atomically and only when its content changed, so
+    readers never see a half-written file and its mtime only moves on real
+    updates (other workers key their caches on it).
     """
     bucket_name = get_bucket_name()
     if not bucket_name:
         return False
         
     try:
-        storage_client = storage.Client()
+        storage_client = get_client()
         bucket = storage_client.bucket(bucket_name)
         blob = bucket.blob(gcs_path)
         
         if not blob.exists():
             return False
             
-        blob.download_to_filename(local_destination)
+        tmp_path = f"{local_destination}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            blob.download_to_filename(tmp_path)
+            if _same_content(tmp_path, local_destination):
+                return True
+            os.replace(tmp_path, local_destination)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
         print(f"Downloaded gs://{bucket_name}/{gcs_path} to {local_destination}")
         return True
     except Exception as e:
         print(f"Failed to download file from GCS: {e}")
         return False
+
+def _same_content(path_a, path_b):
+    if not os.path.exists(path_b) or os.path.getsize(path_a) != os.path.getsize(path_b):
+        return False
+    with open(path_a, "rb") as a, open(path_b, "rb") as b:
+        return a.read() == b.read()
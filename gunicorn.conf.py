@@ -0,0 +1,50 @@
+"""
+Gunicorn settings for serving app:app.
+
+jieba segmentation and LDA inference are CPU-bound and hold the GIL, so
+throughput comes from worker processes rather than threads. Models are loaded
+once in the master (preload_app) and inherited by the forked workers.
+
+Environment overrides:
+    PORT               Port to bind (default 8080)
+    WEB_CONCURRENCY    Worker processes (default: number of usable CPU cores)
+    GUNICORN_THREADS   Threads per worker (default: 8 split across workers, at least 2)
+    PRELOAD_MEDIA      Comma-separated media to preload (default "edh")
+"""
+import gc
+import os
+
+
+def _usable_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+bind = f":{os.environ.get('PORT', '8080')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", _usable_cores()))
+# /train runs synchronously for minutes on a request thread, so keep the old
+# 8 threads on a single core (Cloud Run's default) and fewer per worker above.
+threads = int(os.environ.get("GUNICORN_THREADS", max(2, 8 // workers)))
+# app.py sizes its GCS pool from this
+os.environ.setdefault("GUNICORN_THREADS", str(threads))
+worker_class = "gthread"
+
+# Timeout is set to 0 to disable the timeouts of the workers to allow Cloud Run to handle instance scaling.
+timeout = 0
+
+# Import app.py in the master so models are shared copy-on-write by workers.
+preload_app = True
+
+
+def when_ready(server):
+    # Runs in the master after app.py is imported and before workers fork.
+    from app import preload_models
+
+    preload_models()
+
+    # Move everything loaded so far out of the GC's tracked generations, so
+    # collections in the workers don't touch (and un-share) those pages.
+    gc.freeze()
+    server.log.info(f"Preloaded models. Starting {workers} workers x {threads} threads.")
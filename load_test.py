@@ -0,0 +1,544 @@
+"""
+Load test for the Flask service against a local fake GCS (fake_gcs.py).
+
+Runs the fake GCS in its own process and seeds it with a small synthetic
+model and stopwords, starts the app under gunicorn (gunicorn.conf.py) in a
+scratch directory, drives mixed traffic and reports p50/p95/p99 latency,
+throughput, error rate and memory (PSS, so pages shared copy-on-write by
+preloaded workers count once) per endpoint. Exits with status 1 if a saved
+baseline is exceeded, and refuses to compare against a baseline recorded
+with a different configuration.
+
+    python load_test.py --concurrency 16 --duration 60 --save-baseline loadtest_baseline.json
+    python load_test.py --concurrency 16 --duration 60 --baseline loadtest_baseline.json
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from urllib.parse import quote, urlsplit
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+BUCKET = "loadtest"
+ENDPOINTS = ("predict", "topics", "model_status", "stopwords", "train")
+DEFAULT_MIX = "predict=70,topics=15,model_status=10,stopwords=3,train=2"
+
+# --- Synthetic corpus & seeding ---
+
+def make_vocabulary(num_topics, words_per_topic, seed, media):
+    """
+    Returns num_topics lists of distinct two-character words from jieba's
+    dictionary that jieba segments back as a single token and that are not
+    base stopwords, so /predict texts built from them survive clean_tokens
+    and reach real inference.
+    """
+    import jieba
+    jieba.initialize()
+
+    excluded = set()
+    base_path = os.path.join(REPO_DIR, "data", media, "base_stopwords.json")
+    if os.path.exists(base_path):
+        with open(base_path, "r", encoding="utf-8") as f:
+            excluded = set(json.load(f))
+
+    candidates = sorted(
+        w for w, freq in jieba.dt.FREQ.items()
+        if freq > 0 and len(w) == 2 and all("\u4e00" <= c <= "\u9fa5" for c in w) and w not in excluded
+    )
+    random.Random(seed).shuffle(candidates)
+
+    needed = num_topics * words_per_topic
+    words = []
+    for w in candidates:
+        if jieba.lcut(w) == [w]:
+            words.append(w)
+            if len(words) == needed:
+                break
+    if len(words) < needed:
+        raise SystemExit(f"Only found {len(words)} usable vocabulary words, need {needed}.")
+    return [words[i * words_per_topic:(i + 1) * words_per_topic] for i in range(num_topics)]
+
+def make_documents(topics, count, seed, length=20):
+    rng = random.Random(seed)
+    docs = []
+    for _ in range(count):
+        main, other = rng.sample(range(len(topics)), 2)
+        words = rng.choices(topics[main], k=length - length // 4) + rng.choices(topics[other], k=length // 4)
+        rng.shuffle(words)
+        docs.append(words)
+    return docs
+
+def start_fake_gcs():
+    """
+    Starts fake_gcs.py as a separate process and returns (proc, url).
+    """
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(REPO_DIR, "fake_gcs.py"), "--port", "0"],
+        stdout=subprocess.PIPE, text=True,
+    )
+    url = proc.stdout.readline().strip()
+    if not url:
+        proc.kill()
+        raise SystemExit("Fake GCS server did not start.")
+    return proc, url
+
+def gcs_put(gcs_url, name, data):
+    """
+    Uploads one object to the fake bucket over its JSON API.
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    parts = urlsplit(gcs_url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=60)
+    conn.request("POST", f"/upload/storage/v1/b/{BUCKET}/o?uploadType=media&name={quote(name, safe='')}",
+                 body=data, headers={"Content-Type": "application/octet-stream"})
+    response = conn.getresponse()
+    response.read()
+    conn.close()
+    if response.status != 200:
+        raise SystemExit(f"Seeding {name} into fake GCS failed: HTTP {response.status}")
+
+def seed_bucket(gcs_url, media, topics, workdir, seed):
+    """
+    Trains a small LDA model on synthetic documents and uploads it, with the
+    repo's base stopwords, to the fake bucket. Also writes training data into
+    workdir so /train has something to train on.
+    """
+    from gensim.corpora import Dictionary
+    from gensim.models import LdaModel
+
+    docs = make_documents(topics, 400, seed)
+    id2word = Dictionary(docs)
+    corpus = [id2word.doc2bow(d) for d in docs]
+    model = LdaModel(corpus=corpus, id2word=id2word, num_topics=len(topics), random_state=seed, passes=5, alpha="auto")
+
+    model_dir = tempfile.mkdtemp(prefix="loadtest_model_")
+    try:
+        model.save(os.path.join(model_dir, "lda.model"))
+        id2word.save(os.path.join(model_dir, "id2word.dict"))
+        version = datetime.now().strftime("%Y%m%d_%H%M%S")
+        for file in os.listdir(model_dir):
+            with open(os.path.join(model_dir, file), "rb") as f:
+                gcs_put(gcs_url, f"models/{media}/{version}/{file}", f.read())
+    finally:
+        shutil.rmtree(model_dir, ignore_errors=True)
+
+    base_path = os.path.join(REPO_DIR, "data", media, "base_stopwords.json")
+    base_words = "[]"
+    if os.path.exists(base_path):
+        with open(base_path, "r", encoding="utf-8") as f:
+            base_words = f.read()
+    gcs_put(gcs_url, f"stopwords/{media}/base_stopwords.json", base_words)
+    gcs_put(gcs_url, f"stopwords/{media}/custom_stopwords.json", "[]")
+
+    data_dir = os.path.join(workdir, "data", media)
+    os.makedirs(data_dir, exist_ok=True)
+    train_name = "edh_keywords_2025_new.json" if media == "edh" else "training_data.json"
+    with open(os.path.join(data_dir, train_name), "w", encoding="utf-8") as f:
+        json.dump([{"word": d} for d in docs], f, ensure_ascii=False)
+
+# --- Server process ---
+
+def start_server(workdir, port, gcs_url, args):
+    env = dict(os.environ)
+    env.update({
+        "PORT": str(port),
+        "STORAGE_EMULATOR_HOST": gcs_url,
+        "GCS_BUCKET_NAME": BUCKET,
+        "GOOGLE_CLOUD_PROJECT": "loadtest",
+        # Emulator uses anonymous credentials; keep .env from pointing at a key file
+        "GOOGLE_APPLICATION_CREDENTIALS": "",
+        "PRELOAD_MEDIA": args.media,
+        "PREDICT_MODE": "exact",
+    })
+    if args.workers:
+        env["WEB_CONCURRENCY"] = str(args.workers)
+    if args.threads:
+        env["GUNICORN_THREADS"] = str(args.threads)
+
+    cmd = [
+        sys.executable, "-m", "gunicorn",
+        "--config", os.path.join(REPO_DIR, "gunicorn.conf.py"),
+        "--chdir", workdir,
+        "--pythonpath", REPO_DIR,
+        "app:app",
+    ]
+    log = open(os.path.join(workdir, "server.log"), "wb")
+    proc = subprocess.Popen(cmd, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"Server exited during startup, see {log.name}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", f"/model_status/{args.media}")
+            if conn.getresponse().status == 200:
+                return proc
+        except OSError:
+            pass
+        time.sleep(0.5)
+    proc.terminate()
+    raise SystemExit(f"Server did not become ready in {args.startup_timeout}s, see {log.name}")
+
+def stop_process(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+def check_predict(port, media, topics):
+    """
+    Fails fast unless /predict returns real topics (not the topic_id -1
+    placeholder for "no valid tokens" or "model not loaded").
+    """
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    body = json.dumps({"text": " ".join(topics[0][:10]), "media": media, "mode": "exact"}).encode("utf-8")
+    conn.request("POST", "/predict", body=body, headers={"Content-Type": "application/json"})
+    response = conn.getresponse()
+    data = json.loads(response.read() or b"{}")
+    conn.close()
+    if response.status != 200 or not predict_ok(data):
+        raise SystemExit(f"/predict does not return real topics before the run: {response.status} {data}")
+
+def predict_ok(data):
+    topics = data.get("topics") or []
+    return bool(topics) and all(t.get("topic_id", -1) != -1 for t in topics)
+
+def server_pss_mb(root_pid):
+    """
+    Total PSS of root_pid and its children (gunicorn master + workers), from
+    /proc/<pid>/smaps_rollup. PSS splits shared pages between the processes
+    sharing them, so copy-on-write pages from preloading count once instead of
+    once per worker. Returns None where smaps_rollup is unavailable.
+    """
+    if not os.path.exists(f"/proc/{root_pid}/smaps_rollup"):
+        return None
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            children.setdefault(ppid, []).append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+
+    total_kb, stack = 0, [root_pid]
+    while stack:
+        pid = stack.pop()
+        stack.extend(children.get(pid, []))
+        try:
+            with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+                for line in f:
+                    if line.startswith("Pss:"):
+                        total_kb += int(line.split()[1])
+                        break
+        except OSError:
+            continue
+    return total_kb / 1024
+
+class MemorySampler(threading.Thread):
+    def __init__(self, pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            pss = server_pss_mb(self.pid)
+            if pss is not None:
+                self.samples.append(pss)
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+# --- Traffic ---
+
+def parse_mix(mix):
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise SystemExit(f"Unknown endpoint '{name}' in --mix. Choose from {', '.join(ENDPOINTS)}.")
+        weights[name] = float(weight or 1)
+    return weights
+
+def build_request(endpoint, rng, topics, args):
+    """
+    Returns (method, path, json_body or None) for one request to endpoint.
+    """
+    media = args.media
+    if endpoint == "predict":
+        words = rng.choices(rng.choice(topics), k=rng.randint(3, 15))
+        mode = rng.choice(("exact", "fast")) if args.predict_mode == "mixed" else args.predict_mode
+        return "POST", "/predict", {"text": " ".join(words), "media": media, "mode": mode}
+    if endpoint == "topics":
+        return "GET", f"/topics/{media}", None
+    if endpoint == "model_status":
+        return "GET", f"/model_status/{media}", None
+    if endpoint == "stopwords":
+        # Words outside the synthetic vocabulary, so predictions are unaffected
+        return "POST", "/stopwords", {"media": media, "words": [f"壓測{rng.randint(0, 50)}"]}
+    # The bucket already holds a model, so without force /train only
+    # measures the "model exists, skip" path
+    force = rng.random() < args.train_force_ratio
+    return "POST", "/train", {"media": media, "force": force}
+
+def run_traffic(port, weights, duration, concurrency, topics, args, seed):
+    """
+    Sends requests from `concurrency` threads for `duration` seconds.
+    Returns { endpoint: [(latency_seconds, ok), ...] }.
+    """
+    results = {name: [] for name in weights}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+    names, cum_weights = list(weights), []
+    for name in names:
+        cum_weights.append((cum_weights[-1] if cum_weights else 0) + weights[name])
+
+    def client(index):
+        rng = random.Random(seed * 1000 + index)
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=args.request_timeout)
+        while time.monotonic() < deadline:
+            endpoint = rng.choices(names, cum_weights=cum_weights)[0]
+            method, path, body = build_request(endpoint, rng, topics, args)
+            headers = {"Content-Type": "application/json"} if body is not None else {}
+            payload = json.dumps(body).encode("utf-8") if body is not None else None
+
+            start = time.perf_counter()
+            try:
+                conn.request(method, path, body=payload, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+                ok = 200 <= response.status < 300
+                if ok and endpoint == "predict":
+                    # 200 with topic_id -1 means no inference actually ran
+                    ok = predict_ok(json.loads(data))
+            except (OSError, http.client.HTTPException, ValueError):
+                ok = False
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=args.request_timeout)
+            latency = time.perf_counter() - start
+
+            with lock:
+                results[endpoint].append((latency, ok))
+        conn.close()
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+# --- Reporting ---
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def summarize(samples, duration):
+    latencies = sorted(latency for latency, _ in samples)
+    errors = sum(1 for _, ok in samples if not ok)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": errors / len(samples) if samples else 0.0,
+        "throughput_rps": len(samples) / duration if duration else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+def print_report(report):
+    config = report["config"]
+    print(f"\n{'endpoint':<14}{'reqs':>8}{'err%':>8}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'PSS MB':>10}")
+    rows = list(report["endpoints"].items()) + [("TOTAL", report["total"])]
+    for name, stats in rows:
+        pss = stats.get("pss_peak_mb")
+        pss_text = f"{pss:>10.1f}" if pss is not None else f"{'-':>10}"
+        print(f"{name:<14}{stats['requests']:>8}{stats['error_rate'] * 100:>8.2f}{stats['throughput_rps']:>9.1f}"
+              f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}{pss_text}")
+
+    if not config["isolate_seconds"]:
+        print("\nPer-endpoint PSS not measured (--isolate-seconds 0); the TOTAL row is the whole server.")
+    if "train" in report["endpoints"] and not config["train_force_ratio"]:
+        print("The train row measures only the skip path (model exists); use --train-force-ratio to retrain.")
+
+def config_mismatches(report, baseline):
+    """
+    Returns the config keys on which report and baseline differ; their
+    numbers are not comparable if any do.
+    """
+    current, base = report["config"], baseline.get("config", {})
+    return [f"{key}: {base.get(key)!r} in baseline, {current.get(key)!r} now"
+            for key in sorted(set(current) | set(base)) if current.get(key) != base.get(key)]
+
+def find_regressions(report, baseline, tolerance, error_tolerance):
+    """
+    Returns human-readable regressions of report against baseline.
+    """
+    regressions = []
+    for name, base in baseline.get("endpoints", {}).items():
+        current = report["endpoints"].get(name)
+        if current is None or not base.get("requests"):
+            continue
+        for key in ("p95_ms", "p99_ms"):
+            if current[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{name}: {key} {current[key]:.1f} > baseline {base[key]:.1f}")
+        if current["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {current['throughput_rps']:.1f} rps < baseline {base['throughput_rps']:.1f}")
+        if current["error_rate"] > base["error_rate"] + error_tolerance:
+            regressions.append(f"{name}: error rate {current['error_rate']:.2%} > baseline {base['error_rate']:.2%}")
+        if current.get("pss_peak_mb") and base.get("pss_peak_mb") and current["pss_peak_mb"] > base["pss_peak_mb"] * (1 + tolerance):
+            regressions.append(f"{name}: peak PSS {current['pss_peak_mb']:.1f} MB > baseline {base['pss_peak_mb']:.1f}")
+
+    base_pss, current_pss = baseline.get("pss_mb", {}).get("peak"), report["pss_mb"].get("peak")
+    if base_pss and current_pss and current_pss > base_pss * (1 + tolerance):
+        regressions.append(f"server: peak PSS {current_pss:.1f} MB > baseline {base_pss:.1f}")
+    return regressions
+
+def run_phase(workdir, gcs_url, weights, duration, topics, args):
+    """
+    Starts a fresh server, checks /predict, drives traffic and stops it.
+    A fresh process per phase keeps each phase's memory peak free of what
+    earlier phases allocated. Returns (results, elapsed, pss_samples).
+    """
+    proc = start_server(workdir, args.port, gcs_url, args)
+    try:
+        check_predict(args.port, args.media, topics)
+        sampler = MemorySampler(proc.pid)
+        sampler.start()
+        started = time.monotonic()
+        results = run_traffic(args.port, weights, duration, args.concurrency, topics, args, args.seed)
+        elapsed = time.monotonic() - started
+        sampler.stop()
+        return results, elapsed, sampler.samples
+    finally:
+        stop_process(proc)
+
+def run(args):
+    weights = parse_mix(args.mix)
+    topics = make_vocabulary(args.topics, 30, args.seed, args.media)
+
+    workdir = tempfile.mkdtemp(prefix="loadtest_")
+    gcs_proc, gcs_url = start_fake_gcs()
+    try:
+        print(f"Seeding fake GCS at {gcs_url} ...")
+        seed_bucket(gcs_url, args.media, topics, workdir, args.seed)
+
+        # Optional isolated phases: one endpoint at a time, for per-endpoint memory
+        isolated_pss = {}
+        if args.isolate_seconds > 0:
+            for name in weights:
+                print(f"Isolated phase: {name} for {args.isolate_seconds}s on a fresh server ...")
+                _, _, samples = run_phase(workdir, gcs_url, {name: 1.0}, args.isolate_seconds, topics, args)
+                isolated_pss[name] = max(samples) if samples else None
+
+        print(f"Mixed phase: {args.concurrency} clients for {args.duration}s, mix {args.mix} (server on port {args.port}, workdir {workdir}) ...")
+        results, elapsed, samples = run_phase(workdir, gcs_url, weights, args.duration, topics, args)
+    finally:
+        stop_process(gcs_proc)
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    endpoints = {}
+    for name, endpoint_samples in results.items():
+        endpoints[name] = summarize(endpoint_samples, elapsed)
+        endpoints[name]["pss_peak_mb"] = isolated_pss.get(name)
+
+    return {
+        "config": {
+            "media": args.media,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "mix": args.mix,
+            "workers": args.workers,
+            "threads": args.threads,
+            "predict_mode": args.predict_mode,
+            "train_force_ratio": args.train_force_ratio,
+            "isolate_seconds": args.isolate_seconds,
+            "topics": args.topics,
+            "seed": args.seed,
+        },
+        "endpoints": endpoints,
+        "total": summarize([s for endpoint_samples in results.values() for s in endpoint_samples], elapsed),
+        "pss_mb": {
+            "start": samples[0] if samples else None,
+            "peak": max(samples) if samples else None,
+            "end": samples[-1] if samples else None,
+        },
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Flask service against a local fake GCS.")
+    parser.add_argument("--media", type=str, default="edh", help="Media name to seed and query")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent client threads")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of mixed traffic")
+    parser.add_argument("--mix", type=str, default=DEFAULT_MIX, help="Endpoint weights, e.g. 'predict=70,topics=15,model_status=10,stopwords=3,train=2'")
+    parser.add_argument("--predict-mode", choices=("exact", "fast", "mixed"), default="exact", help="Scoring mode sent with /predict")
+    parser.add_argument("--train-force-ratio", type=float, default=0.0, help="Share of /train requests sent with force=true (each runs a full K sweep); at 0 /train only exercises the skip path")
+    parser.add_argument("--isolate-seconds", type=float, default=10, help="Run each endpoint alone on a fresh server for this long first to measure its peak memory (0 disables per-endpoint PSS)")
+    parser.add_argument("--workers", type=int, default=None, help="WEB_CONCURRENCY for the server (default: gunicorn.conf.py)")
+    parser.add_argument("--threads", type=int, default=None, help="GUNICORN_THREADS for the server (default: gunicorn.conf.py)")
+    parser.add_argument("--topics", type=int, default=8, help="Topics in the seeded synthetic model")
+    parser.add_argument("--port", type=int, default=18080, help="Port for the server under test")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for corpus and traffic")
+    parser.add_argument("--request-timeout", type=float, default=120, help="Client timeout per request in seconds")
+    parser.add_argument("--startup-timeout", type=float, default=120, help="Seconds to wait for the server to come up")
+    parser.add_argument("--keep-workdir", action="store_true", help="Keep the scratch directory (server.log, models) after the run")
+    parser.add_argument("--output", type=str, default=None, help="Write the JSON report here")
+    parser.add_argument("--baseline", type=str, default=None, help="Fail if results regress past this saved report")
+    parser.add_argument("--save-baseline", type=str, default=None, help="Save this run's report as a baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative regression for latency, throughput and memory")
+    parser.add_argument("--error-tolerance", type=float, default=0.01, help="Allowed absolute increase in error rate")
+    args = parser.parse_args()
+
+    report = run(args)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        mismatches = config_mismatches(report, baseline)
+        if mismatches:
+            print("\nBaseline was recorded with a different configuration, not comparing:")
+            for line in mismatches:
+                print(f"  - {line}")
+            sys.exit(2)
+        regressions = find_regressions(report, baseline, args.tolerance, args.error_tolerance)
+        if regressions:
+            print("\nRegressions against baseline:")
+            for line in regressions:
+                print(f"  - {line}")
+            sys.exit(1)
+        print("\nNo regressions against baseline.")
+
+if __name__ == "__main__":
+    main()
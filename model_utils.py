@@ -1,15 +1,22 @@
 import gensim
 from gensim.corpora import Dictionary
 from gensim.models import LdaModel
+import numpy as np
 import os
+import shutil
+import threading
+import weakref
 import stopwords
 import gcs_handler
 
+# Precomputed word -> topic probability tables for fast scoring: { model: ndarray (num_terms, num_topics) }
+_word_topic_tables = weakref.WeakKeyDictionary()
+
 def clean_tokens(words, media_name="edh"):
     """
     Preprocessing logic.
     """
-    stop_words = stopwords.get_stopwords(media_name)
+    stop_words = stopwords.get_cached_stopwords(media_name)
     tokens = []
     for w in words:
         if not isinstance(w, str):
@@ -24,16 +31,61 @@ def clean_tokens(words, media_name="edh"):
         tokens.append(w)
     return tokens
 
+# Local layout: models/{media}/versions/{version}/ holds one immutable saved
+# model, and models/{media}/current is a symlink to the live one. Publishing a
+# model is a single atomic symlink swap, so readers never see a half-written
+# model or a model paired with another version's dictionary.
+
+def get_current_model_dir(media_name="edh"):
+    """
+    Directory of the live model for media_name, or None if there is none.
+    Falls back to the legacy flat layout (models/{media}/lda.model).
+    The returned path also serves as the model's version marker.
+    """
+    root = os.path.join("models", media_name)
+    link = os.path.join(root, "current")
+    if os.path.islink(link):
+        return os.path.join(root, os.readlink(link))
+    if os.path.exists(os.path.join(root, "lda.model")):
+        return root
+    return None
+
+def get_version_dir(media_name, version):
+    return os.path.join("models", media_name, "versions", version)
+
+def publish_model_version(media_name, version):
+    """
+    Atomically points models/{media}/current at versions/{version}.
+    """
+    root = os.path.join("models", media_name)
+    tmp_link = os.path.join(root, f".current.{os.getpid()}.{threading.get_ident()}")
+    os.symlink(os.path.join("versions", version), tmp_link)
+    os.replace(tmp_link, os.path.join(root, "current"))
+
+def prune_model_versions(media_name, keep=2):
+    """
+    Deletes local versions except the live one and the newest `keep`.
+    The previous version is kept because another worker may still be
+    loading it.
+    """
+    versions_dir = os.path.join("models", media_name, "versions")
+    if not os.path.isdir(versions_dir):
+        return
+    current = get_current_model_dir(media_name)
+    versions = sorted(v for v in os.listdir(versions_dir) if not v.startswith("."))
+    for version in versions[:-keep]:
+        version_dir = os.path.join(versions_dir, version)
+        if current is None or os.path.abspath(version_dir) != os.path.abspath(current):
+            shutil.rmtree(version_dir, ignore_errors=True)
+
 def load_model(media_name="edh"):
     """
     Load the LDA model and dictionary for a specific media.
     Returns tuple (model, dictionary)
     """
-    model_dir = os.path.join("models", media_name)
-    model_path = os.path.join(model_dir, "lda.model")
-    dict_path = os.path.join(model_dir, "id2word.dict")
+    model_dir = get_current_model_dir(media_name)
 
-    if not os.path.exists(model_path):
+    if model_dir is None:
         print(f"Model not found locally for {media_name}. Checking GCS...")
         
         versions = gcs_handler.list_model_versions(media_name)
@@ -41,15 +93,29 @@ def load_model(media_name="edh"):
             latest_version = versions[-1]
             print(f"Found latest version {latest_version} in GCS. Downloading...")
             
-            # We download the contents of the version folder into the FLAT local model dir
-            success = gcs_handler.download_specific_version(media_name, latest_version, model_dir)
-            
-            if not success:
-                print(f"Failed to download version {latest_version}")
-                return None, None
+            # Download next to the final dir and rename, so a version dir is
+            # complete whenever it exists
+            version_dir = get_version_dir(media_name, latest_version)
+            if not os.path.isdir(version_dir):
+                tmp_dir = f"{version_dir}.tmp-{os.getpid()}-{threading.get_ident()}"
+                success = gcs_handler.download_specific_version(media_name, latest_version, tmp_dir)
+                if not success:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+                    print(f"Failed to download version {latest_version}")
+                    return None, None
+                try:
+                    os.rename(tmp_dir, version_dir)
+                except OSError:
+                    # Another worker finished the same download first
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+            publish_model_version(media_name, latest_version)
+            model_dir = version_dir
         else:
             print(f"No models found in GCS for {media_name}")
             return None, None
+
+    model_path = os.path.join(model_dir, "lda.model")
+    dict_path = os.path.join(model_dir, "id2word.dict")
     
     try:
         model = LdaModel.load(model_path)
@@ -58,15 +124,70 @@ def load_model(media_name="edh"):
         else:
             print(f"Warning: Dictionary not found at {dict_path}")
             dictionary = None
+
+        _word_topic_tables[model] = build_word_topic_table(model)
             
         return model, dictionary
     except Exception as e:
         print(f"Error loading model for {media_name}: {e}")
         return None, None
 
-def get_topics(model_tuple, text_or_tokens, media_name="edh"):
+def build_word_topic_table(model):
+    """
+    Returns p(topic | word) for every dictionary word, shape (num_terms, num_topics).
+    Built from expElogbeta weighted by the topic prior alpha, normalized per word.
+    """
+    weights = model.expElogbeta * np.asarray(model.alpha)[:, None]
+    totals = weights.sum(axis=0)
+    totals[totals == 0] = 1.0
+    return (weights / totals).T.astype(np.float32)
+
+def get_word_topic_table(model):
+    table = _word_topic_tables.get(model)
+    if table is None:
+        table = build_word_topic_table(model)
+        _word_topic_tables[model] = table
+    return table
+
+def fast_document_topics(model, bow, minimum_probability=0.01):
+    """
+    Approximate get_document_topics without variational inference: the
+    count-weighted sum of the words' topic rows, renormalized.
+    Returns [(topic_id, probability), ...] like get_document_topics; a bow
+    with no usable words gets the normalized alpha prior, as the exact path.
+    """
+    if not bow:
+        return _prior_topics(model, minimum_probability)
+    table = get_word_topic_table(model)
+    ids = np.fromiter((i for i, _ in bow), dtype=np.int64, count=len(bow))
+    counts = np.fromiter((c for _, c in bow), dtype=np.float32, count=len(bow))
+
+    dist = counts @ table[ids]
+    total = dist.sum()
+    if total <= 0:
+        return _prior_topics(model, minimum_probability)
+    dist /= total
+    return [(tid, float(p)) for tid, p in enumerate(dist) if p >= minimum_probability]
+
+def _prior_topics(model, minimum_probability):
+    prior = np.asarray(model.alpha, dtype=np.float64)
+    prior = prior / prior.sum()
+    return [(tid, float(p)) for tid, p in enumerate(prior) if p >= minimum_probability]
+
+def infer_topics(model, bow, exact=True, minimum_probability=0.01):
+    """
+    Topic distribution for a BoW vector: full variational inference if exact,
+    else the precomputed word-topic table (see fast_document_topics).
+    """
+    if exact:
+        return model.get_document_topics(bow, minimum_probability=minimum_probability)
+    return fast_document_topics(model, bow, minimum_probability=minimum_probability)
+
+def get_topics(model_tuple, text_or_tokens, media_name="edh", exact=True):
     """
     Get topics for the input.
+    exact=False scores with the precomputed word-topic table instead of
+    running inference (faster, approximate).
     """
     model, dictionary = model_tuple
     
@@ -93,7 +214,7 @@ def get_topics(model_tuple, text_or_tokens, media_name="edh"):
     bow = dictionary.doc2bow(clean)
     print(f"BoW Vector (ID, Count): {bow}")
     
-    topic_distResult = model.get_document_topics(bow, minimum_probability=0.01)
+    topic_distResult = infer_topics(model, bow, exact=exact)
     print(f"Topic Distribution: {topic_distResult}")
     
     sorted_topics = sorted(topic_distResult, key=lambda x: x[1], reverse=True)
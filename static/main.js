@@ -1,5 +1,16 @@
 console.log("LDA App Loaded");
 
+// The storage endpoints answer 503 + Retry-After when the server is busy
+// with other bucket calls; retry those a few times before giving up.
+async function fetchWithRetry(url, options = {}, attempts = 5) {
+    for (let i = 1; ; i++) {
+        const response = await fetch(url, options);
+        if (response.status !== 503 || i >= attempts) return response;
+        const retryAfter = parseFloat(response.headers.get('Retry-After')) || 1;
+        await new Promise(resolve => setTimeout(resolve, retryAfter * 1000));
+    }
+}
+
 document.addEventListener('DOMContentLoaded', () => {
     const btn = document.getElementById('predictBtn');
     const input = document.getElementById('textInput');
@@ -66,10 +77,13 @@ document.addEventListener('DOMContentLoaded', () => {
         modelInfo.style.color = "#888";
 
         try {
-            const response = await fetch(`/model_status/${media}`);
+            const response = await fetchWithRetry(`/model_status/${media}`);
             const data = await response.json();
 
-            if (data.exists) {
+            if (!response.ok) {
+                modelInfo.innerText = `Error checking status: ${data.error || response.status}`;
+                modelInfo.style.color = "red";
+            } else if (data.exists) {
                 // Formatting timestamp 20241222_1500xx to readable if possible, or just show it
                 const v = data.version;
                 // Simple formatting: 20241222_150000 -> 2024-12-22 15:00:00
@@ -201,11 +215,17 @@ document.addEventListener('DOMContentLoaded', () => {
 
             try {
                 // 1. Send stopwords
-                await fetch('/stopwords', {
+                const stopwordsResponse = await fetchWithRetry('/stopwords', {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
                     body: JSON.stringify({ media, words })
                 });
+                const stopwordsData = await stopwordsResponse.json();
+
+                if (!stopwordsResponse.ok || !stopwordsData.success) {
+                    alert("Error saving stopwords, model not retrained: " + stopwordsData.message);
+                    return;
+                }
 
                 // 2. Trigger Retrain
                 // Reuse the existing train logic via fetch
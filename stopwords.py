@@ -1,7 +1,34 @@
 import os
 import json
+import threading
+import time
 import gcs_handler
 
+# Seconds before cached stopwords are re-synced from GCS (picks up edits made
+# on other instances).
+STOPWORDS_CACHE_TTL = int(os.environ.get("STOPWORDS_CACHE_TTL", 300))
+
+# Per-process cache for inference: { "media_name": (file_mtimes, loaded_at, stopwords_set) }
+_cached_stopwords = {}
+_cache_lock = threading.Lock()
+
+def _stopword_paths(media_name):
+    return (
+        os.path.join("data", media_name, "base_stopwords.json"),
+        os.path.join("data", media_name, "custom_stopwords.json"),
+    )
+
+def _file_mtimes(media_name):
+    """
+    Modification times of the local stopword files.
+    Workers share the container filesystem, so this lets every worker notice
+    an update written by another one.
+    """
+    return tuple(
+        os.path.getmtime(p) if os.path.exists(p) else None
+        for p in _stopword_paths(media_name)
+    )
+
 def get_stopwords(media_name="edh"):
     """
     Return stopwords set for the specific media.
@@ -14,7 +41,7 @@ def get_stopwords(media_name="edh"):
 
     
     # --- Load Base Stopwords (Template) ---
-    base_path = os.path.join("data", media_name, "base_stopwords.json")
+    base_path, custom_path = _stopword_paths(media_name)
     base_gcs = f"stopwords/{media_name}/base_stopwords.json"
     
     # Sync: Always try to download from GCS to get latest updates
@@ -30,7 +57,6 @@ def get_stopwords(media_name="edh"):
             print(f"Warning: Could not load base stopwords: {e}")
     
     # Load custom stopwords from file by syncing with GCS
-    custom_path = os.path.join("data", media_name, "custom_stopwords.json")
     gcs_path = f"stopwords/{media_name}/custom_stopwords.json"
     
     # Sync: Always download
@@ -45,4 +71,25 @@ def get_stopwords(media_name="edh"):
         except Exception as e:
             print(f"Warning: Could not load custom stopwords: {e}")
 
+    with _cache_lock:
+        _cached_stopwords[media_name] = (_file_mtimes(media_name), time.monotonic(), base_stopwords)
+
     return base_stopwords
+
+def get_cached_stopwords(media_name="edh"):
+    """
+    Return stopwords set for inference without a GCS round-trip per request.
+    Syncs from GCS on first use, whenever the local files change, and after
+    STOPWORDS_CACHE_TTL seconds.
+    """
+    entry = _cached_stopwords.get(media_name)
+    if entry is not None:
+        mtimes, loaded_at, words = entry
+        fresh = time.monotonic() - loaded_at < STOPWORDS_CACHE_TTL
+        if fresh and mtimes == _file_mtimes(media_name):
+            return words
+    return get_stopwords(media_name)
+
+def clear_cached_stopwords(media_name):
+    with _cache_lock:
+        _cached_stopwords.pop(media_name, None)
@@ -1,5 +1,9 @@
 import json
 import os
+import shutil
+import hashlib
+import threading
+import time
 import argparse
 import pandas as pd
 from tqdm import tqdm
@@ -9,7 +13,8 @@ from gensim.models.coherencemodel import CoherenceModel
 import warnings
 import stopwords
 import gcs_handler
-from datetime import datetime
+import model_utils
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 import string
 
@@ -19,6 +24,22 @@ load_dotenv()
 # Suppress DeprecationWarning
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
+# Candidate topic counts and LDA settings for the coherence sweep.
+# Part of the sweep id, so changing them invalidates old checkpoints.
+K_RANGE = range(3, 21)
+LDA_PARAMS = {"random_state": 42, "passes": 10, "alpha": "auto", "per_word_topics": True}
+
+# Share of documents set aside (by content hash, so the split is stable
+# across runs) in data/{media}/holdout.json for evaluate_fast_scoring.py.
+HOLDOUT_FRACTION = float(os.environ.get("TRAIN_HOLDOUT_FRACTION", 0.1))
+HOLDOUT_FILENAME = "holdout.json"
+
+# Local root for per-K sweep checkpoints: checkpoints/{media}/{sweep_id}/
+# Kept outside models/ so they never mix with published model versions.
+CHECKPOINT_ROOT = "checkpoints"
+# Sweeps of a media untouched for this long (local and in GCS) are treated as abandoned
+CHECKPOINT_MAX_AGE = float(os.environ.get("TRAIN_CHECKPOINT_MAX_AGE_HOURS", 72)) * 3600
+
 def clean_tokens(words, stop_words):
     tokens = []
     for w in words:
@@ -34,9 +55,132 @@ def clean_tokens(words, stop_words):
         tokens.append(w)
     return tokens
 
-def train(media="edh", force=False):
+def _file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _sweep_id(data_hash, stopwords_hash):
+    """
+    Identifies a K sweep by its inputs: a rerun with the same training data,
+    stopwords and settings resumes it, anything else starts over.
+    """
+    params = json.dumps({"k_range": [K_RANGE.start, K_RANGE.stop], "lda": LDA_PARAMS, "holdout": HOLDOUT_FRACTION}, sort_keys=True)
+    return hashlib.sha256(f"{data_hash}|{stopwords_hash}|{params}".encode("utf-8")).hexdigest()[:16]
+
+def _is_holdout(words):
+    """
+    Deterministically assigns a document to the holdout split by hashing its
+    words, so the same document lands on the same side in every run.
+    """
+    digest = hashlib.sha1(json.dumps(words, ensure_ascii=False).encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "big") % 10000 < HOLDOUT_FRACTION * 10000
+
+def _write_holdout(path, docs):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(docs, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def _write_manifest(path, manifest):
+    """
+    Merges manifest["completed"] into the manifest on disk and writes it back.
+    Concurrent runs of the same sweep therefore add to each other's K values
+    instead of overwriting them. Write-then-rename (with a per-writer temp
+    name) so a crash never leaves a half-written manifest.
+    """
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                on_disk = json.load(f)
+            if on_disk.get("sweep_id") == manifest["sweep_id"]:
+                for k, score in on_disk.get("completed", {}).items():
+                    manifest["completed"].setdefault(k, score)
+        except Exception as e:
+            print(f"Warning: Could not merge existing sweep manifest: {e}")
+
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+def _remove_stale_sweeps(media, keep_sweep_id, gcs_checkpoints=False):
+    """
+    Deletes sweeps of media other than keep_sweep_id that have not been
+    written to for CHECKPOINT_MAX_AGE, locally and (if gcs_checkpoints) in
+    GCS. Recent ones may belong to a run still in progress, so they are
+    left alone.
+    """
+    if gcs_checkpoints:
+        _remove_stale_gcs_sweeps(media, keep_sweep_id)
+
+    media_dir = os.path.join(CHECKPOINT_ROOT, media)
+    if not os.path.isdir(media_dir):
+        return
+    for sweep_id in os.listdir(media_dir):
+        sweep_dir = os.path.join(media_dir, sweep_id)
+        if sweep_id == keep_sweep_id or not os.path.isdir(sweep_dir):
+            continue
+        manifest_path = os.path.join(sweep_dir, "manifest.json")
+        last_write = os.path.getmtime(manifest_path if os.path.exists(manifest_path) else sweep_dir)
+        if time.time() - last_write > CHECKPOINT_MAX_AGE:
+            print(f"Removing abandoned sweep checkpoints {sweep_dir}")
+            shutil.rmtree(sweep_dir, ignore_errors=True)
+
+def _remove_stale_gcs_sweeps(media, keep_sweep_id):
+    """
+    GCS side of _remove_stale_sweeps: ages a sweep by the last upload of its
+    manifest (or of its dictionary if no K finished yet).
+    """
+    prefix = f"checkpoints/{media}/"
+    try:
+        sweep_ids = gcs_handler.list_subfolders(prefix)
+    except Exception as e:
+        print(f"Warning: Could not list GCS sweep checkpoints: {e}")
+        return
+
+    now = datetime.now(timezone.utc)
+    for sweep_id in sweep_ids:
+        if sweep_id == keep_sweep_id:
+            continue
+        last_write = (gcs_handler.get_updated_time(f"{prefix}{sweep_id}/manifest.json")
+                      or gcs_handler.get_updated_time(f"{prefix}{sweep_id}/id2word.dict"))
+        if last_write is None:
+            continue
+        if (now - last_write).total_seconds() > CHECKPOINT_MAX_AGE:
+            print(f"Removing abandoned sweep checkpoints gs://{gcs_handler.get_bucket_name()}/{prefix}{sweep_id}/")
+            gcs_handler.delete_folder(f"{prefix}{sweep_id}/")
+
+def _load_manifest(media, sweep_id, checkpoint_dir, gcs_checkpoints):
+    """
+    Returns the sweep manifest for sweep_id, fetching the checkpoints from GCS
+    if they are not available locally. Returns a fresh manifest otherwise.
+    """
+    manifest_path = os.path.join(checkpoint_dir, "manifest.json")
+
+    if not os.path.exists(manifest_path) and gcs_checkpoints:
+        print(f"Looking for sweep checkpoints in GCS under checkpoints/{media}/{sweep_id}/ ...")
+        gcs_handler.download_folder(f"checkpoints/{media}/{sweep_id}/", checkpoint_dir)
+
+    if os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("sweep_id") == sweep_id:
+                return manifest
+        except Exception as e:
+            print(f"Warning: Could not read sweep manifest, starting over: {e}")
+
+    return {"sweep_id": sweep_id, "completed": {}}
+
+def train(media="edh", force=False, gcs_checkpoints=None):
     """
     Train LDA model for a specific media.
+    Each K of the sweep is checkpointed under checkpoints/{media}/{sweep_id}/
+    (and to GCS if gcs_checkpoints, default from TRAIN_CHECKPOINT_GCS), so an
+    interrupted run resumes from the last finished K.
     Returns:
         dict: result status and message
     """
@@ -61,9 +205,6 @@ def train(media="edh", force=False):
          # Try generic name
          train_json_path = os.path.join(data_dir, "training_data.json")
 
-    model_save_path = os.path.join(model_dir, "lda.model")
-    dict_save_path = os.path.join(model_dir, "id2word.dict")
-
     if not os.path.exists(train_json_path):
         return {"success": False, "message": f"Training data not found at {train_json_path}"}
 
@@ -78,52 +219,96 @@ def train(media="edh", force=False):
         stop_words_set = stopwords.get_stopwords(media)
 
         train_docs = []
+        holdout_docs = []
         print("Preprocessing...")
         # Note: tqdm might clutter logs in web app context, mainly for CLI
         for doc in raw_docs: 
             words = doc.get("word", [])
             if isinstance(words, list):
+                if _is_holdout(words):
+                    holdout_docs.append({"word": words})
+                    continue
                 tokens = clean_tokens(words, stop_words_set)
                 if len(tokens) >= 3:
                     train_docs.append(tokens)
 
-        print("Training documents:", len(train_docs))
+        holdout_path = os.path.join(data_dir, HOLDOUT_FILENAME)
+        _write_holdout(holdout_path, holdout_docs)
+        print(f"Training documents: {len(train_docs)} (holdout: {len(holdout_docs)} in {holdout_path})")
         if len(train_docs) == 0:
             return {"success": False, "message": "No valid documents found after preprocessing."}
 
-        # Create Dictionary
-        id2word = Dictionary(train_docs)
+        # --- Resume a checkpointed sweep if one matches these inputs ---
+        if gcs_checkpoints is None:
+            gcs_checkpoints = os.environ.get("TRAIN_CHECKPOINT_GCS", "").lower() in ("1", "true", "yes")
+
+        stopwords_hash = hashlib.sha256("\n".join(sorted(stop_words_set)).encode("utf-8")).hexdigest()
+        sweep_id = _sweep_id(_file_sha256(train_json_path), stopwords_hash)
+        checkpoint_dir = os.path.join(CHECKPOINT_ROOT, media, sweep_id)
+        gcs_checkpoint_path = f"checkpoints/{media}/{sweep_id}"
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+        manifest_path = os.path.join(checkpoint_dir, "manifest.json")
+        manifest = _load_manifest(media, sweep_id, checkpoint_dir, gcs_checkpoints)
+        completed = manifest["completed"]
+        # -------------------------------------
+
+        # Create Dictionary (reuse the checkpointed one so resumed models match it)
+        checkpoint_dict_path = os.path.join(checkpoint_dir, "id2word.dict")
+        if completed and os.path.exists(checkpoint_dict_path):
+            id2word = Dictionary.load(checkpoint_dict_path)
+        else:
+            id2word = Dictionary(train_docs)
+            id2word.save(checkpoint_dict_path)
+            if gcs_checkpoints:
+                gcs_handler.upload_file(checkpoint_dict_path, f"{gcs_checkpoint_path}/id2word.dict")
         corpus = [id2word.doc2bow(text) for text in train_docs]
 
         best_k = 10 
         best_score = -1.0
+        # Best model if it was trained in this run, so it doesn't depend on the checkpoint
         best_model = None
 
-        print("Calculating Coherence Scores for K=3..20...")
+        print(f"Calculating Coherence Scores for K={K_RANGE.start}..{K_RANGE.stop - 1} (sweep {sweep_id})...")
         # Loop to find best K
         coherence_scores = []
-        for k in range(3, 21):
-            # Train temp model
-            lda_temp = LdaModel(
-                corpus=corpus,
-                id2word=id2word,
-                num_topics=k,
-                random_state=42,
-                passes=10,
-                alpha='auto',
-                per_word_topics=True
-            )
-            
-            # Calculate consistency
-            cm = CoherenceModel(
-                model=lda_temp,
-                texts=train_docs,
-                dictionary=id2word,
-                coherence='c_v'
-            )
-            score = cm.get_coherence()
-            msg = f"K={k} → Coherence={score:.4f}"
-            print(msg)
+        for k in K_RANGE:
+            k_dir = os.path.join(checkpoint_dir, f"k{k}")
+            k_model_path = os.path.join(k_dir, "lda.model")
+
+            lda_temp = None
+            if str(k) in completed and os.path.exists(k_model_path):
+                score = completed[str(k)]
+                print(f"K={k} → Coherence={score:.4f} (from checkpoint)")
+            else:
+                # Train temp model
+                lda_temp = LdaModel(
+                    corpus=corpus,
+                    id2word=id2word,
+                    num_topics=k,
+                    **LDA_PARAMS
+                )
+                
+                # Calculate consistency
+                cm = CoherenceModel(
+                    model=lda_temp,
+                    texts=train_docs,
+                    dictionary=id2word,
+                    coherence='c_v'
+                )
+                score = cm.get_coherence()
+                msg = f"K={k} → Coherence={score:.4f}"
+                print(msg)
+
+                # Checkpoint the model before recording it as done
+                os.makedirs(k_dir, exist_ok=True)
+                lda_temp.save(k_model_path)
+                completed[str(k)] = score
+                _write_manifest(manifest_path, manifest)
+                if gcs_checkpoints:
+                    gcs_handler.upload_folder(k_dir, f"{gcs_checkpoint_path}/k{k}")
+                    gcs_handler.upload_file(manifest_path, f"{gcs_checkpoint_path}/manifest.json")
+
             coherence_scores.append({"k": k, "score": score})
             
             if score > best_score:
@@ -135,31 +320,58 @@ def train(media="edh", force=False):
         
         # Use best model
         lda_final = best_model
+        if lda_final is None:
+            lda_final = LdaModel.load(os.path.join(checkpoint_dir, f"k{best_k}", "lda.model"))
 
-        print(f"Saving model to {model_save_path}...")
-        lda_final.save(model_save_path)
-        id2word.save(dict_save_path)
-        
-        # --- GCS Upload & Cleanup ---
         # Generate timestamp
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+        # Save into a temp dir, rename it to versions/{timestamp} and then swap
+        # the models/{media}/current symlink, so serving workers only ever see
+        # a complete model + dictionary pair.
+        version_dir = model_utils.get_version_dir(media, timestamp)
+        tmp_dir = f"{version_dir}.tmp-{os.getpid()}-{threading.get_ident()}"
+        os.makedirs(tmp_dir, exist_ok=True)
+        print(f"Saving model to {version_dir}...")
+        lda_final.save(os.path.join(tmp_dir, "lda.model"))
+        id2word.save(os.path.join(tmp_dir, "id2word.dict"))
+        os.rename(tmp_dir, version_dir)
+        model_utils.publish_model_version(media, timestamp)
+        model_utils.prune_model_versions(media)
+        
+        # --- GCS Upload & Cleanup ---
         gcs_version_path = f"models/{media}/{timestamp}"
         
         print(f"Uploading model to GCS version: {timestamp}...")
-        gcs_handler.upload_folder(model_dir, gcs_version_path)
-        
-        # Cleanup old versions (Overwrite logic)
-        existing = gcs_handler.list_model_versions(media)
-        for old_ver in existing:
-            if old_ver != timestamp:
-                print(f"Removing old version {old_ver} from GCS...")
-                gcs_handler.delete_version(media, old_ver)
+        uploaded = gcs_handler.upload_folder(version_dir, gcs_version_path)
+        message = f"Model trained for {media} with K={best_k} (Score={best_score:.4f}). Saved version {timestamp}."
+
+        if uploaded or not gcs_handler.get_bucket_name():
+            # Cleanup old versions (Overwrite logic)
+            existing = gcs_handler.list_model_versions(media)
+            for old_ver in existing:
+                if old_ver != timestamp:
+                    print(f"Removing old version {old_ver} from GCS...")
+                    gcs_handler.delete_version(media, old_ver)
+
+            # Best model is promoted, drop this sweep's checkpoints only: other
+            # sweeps of the media may still be running (other worker or instance)
+            shutil.rmtree(checkpoint_dir, ignore_errors=True)
+            if gcs_checkpoints:
+                gcs_handler.delete_folder(f"{gcs_checkpoint_path}/")
+        else:
+            # Old GCS versions and the checkpoints are the only durable copy
+            # until a later run uploads successfully.
+            print("Upload failed, keeping old GCS versions and sweep checkpoints.")
+            message += " Upload to GCS failed; old versions and checkpoints were kept."
         # ----------------------------
 
+        _remove_stale_sweeps(media, sweep_id, gcs_checkpoints)
+
         print("Done.")
         return {
             "success": True, 
-            "message": f"Model trained for {media} with K={best_k} (Score={best_score:.4f}). Saved version {timestamp}.",
+            "message": message,
             "scores": coherence_scores
         }
     
@@ -171,9 +383,10 @@ def main():
     parser = argparse.ArgumentParser(description="Train LDA model for a specific media.")
     parser.add_argument("--media", type=str, default="edh", help="Media name (folder name in data/)")
     parser.add_argument("--force", action="store_true", help="Force retraining even if model exists in GCS")
+    parser.add_argument("--gcs-checkpoints", action="store_true", default=None, help="Also checkpoint each K to GCS so another machine can resume the sweep")
     args = parser.parse_args()
     
-    result = train(args.media, force=args.force)
+    result = train(args.media, force=args.force, gcs_checkpoints=args.gcs_checkpoints)
     print(result)
 
 if __name__ == "__main__":